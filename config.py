@@ -7,4 +7,21 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASSWORD', 'root@123'),
     'host': os.getenv('DB_HOST', 'localhost'),
     'port': os.getenv('DB_PORT', '5432')
-}
\ No newline at end of file
+}
+
+# Schema mode: 'partitioned' stores metadata in monthly partitions and
+# compressed bodies in a side table; anything else keeps the single table.
+PARTITIONED_SCHEMA = os.getenv('EMAIL_SCHEMA', 'single').lower() == 'partitioned'
+
+# Months of partitions kept by the retention job (partitioned schema only)
+RETENTION_MONTHS = int(os.getenv('RETENTION_MONTHS', '12'))
+RETENTION_ARCHIVE = os.getenv('RETENTION_ARCHIVE', 'false').lower() == 'true'
+
+# Rule daemon: seconds between Gmail polls and messages per listing page.
+# Each poll follows nextPageToken until it reaches an already stored message,
+# up to DAEMON_MAX_PAGES pages; if more than DAEMON_MAX_RESULTS *
+# DAEMON_MAX_PAGES messages arrive between polls (or while the daemon is
+# down), the oldest of them are not fetched.
+DAEMON_POLL_INTERVAL = int(os.getenv('DAEMON_POLL_INTERVAL', '30'))
+DAEMON_MAX_RESULTS = int(os.getenv('DAEMON_MAX_RESULTS', '50'))
+DAEMON_MAX_PAGES = int(os.getenv('DAEMON_MAX_PAGES', '10'))
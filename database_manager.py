@@ -1,11 +1,36 @@
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from datetime import datetime
+import zlib
+
+# Rows without a Date header are parked at this sentinel in partitioned mode,
+# since the partition key is part of the primary key and cannot be NULL.
+# It lies outside any real mail date (unlike the Unix epoch, which broken
+# Date headers produce) and always stays in emails_default.
+NO_DATE = datetime(1, 1, 1)
+
+def month_start(date):
+    return datetime(date.year, date.month, 1)
+
+def next_month(date):
+    if date.month == 12:
+        return datetime(date.year + 1, 1, 1)
+    return datetime(date.year, date.month + 1, 1)
+
+def previous_month(date):
+    if date.month == 1:
+        return datetime(date.year - 1, 12, 1)
+    return datetime(date.year, date.month - 1, 1)
+
+def partition_name(date):
+    return f"emails_y{date.year:04d}m{date.month:02d}"
 
 class DatabaseManager:
-    def __init__(self, db_config):
+    def __init__(self, db_config, partitioned=False):
         self.db_config = db_config
+        self.partitioned = partitioned
         self.conn = None
+        self._known_partitions = set()
         
     def connect(self):
         try:
@@ -16,6 +41,9 @@ class DatabaseManager:
             raise
     
     def create_tables(self):
+        if self.partitioned:
+            return self.create_partitioned_tables()
+        
         create_table_query = """
         CREATE TABLE IF NOT EXISTS emails (
             id SERIAL PRIMARY KEY,
@@ -46,7 +74,64 @@ class DatabaseManager:
             print(f"Error creating tables: {e}")
             raise
     
+    def create_partitioned_tables(self):
+        # Metadata is range-partitioned by month on received_date; bodies live
+        # in a separate zlib-compressed side table keyed by message_id.
+        create_table_query = """
+        CREATE TABLE IF NOT EXISTS emails (
+            id SERIAL,
+            message_id VARCHAR(255) NOT NULL,
+            thread_id VARCHAR(255),
+            from_email VARCHAR(255),
+            to_email TEXT,
+            subject TEXT,
+            received_date TIMESTAMP NOT NULL,
+            is_read BOOLEAN DEFAULT FALSE,
+            labels TEXT[],
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (message_id, received_date)
+        ) PARTITION BY RANGE (received_date);
+        
+        CREATE TABLE IF NOT EXISTS emails_default PARTITION OF emails DEFAULT;
+        
+        CREATE TABLE IF NOT EXISTS email_bodies (
+            message_id VARCHAR(255) PRIMARY KEY,
+            body_compressed BYTEA
+        );
+        
+        CREATE INDEX IF NOT EXISTS idx_from_email ON emails(from_email);
+        CREATE INDEX IF NOT EXISTS idx_received_date ON emails(received_date);
+        """
+        
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(create_table_query)
+            self.conn.commit()
+            cursor.close()
+            print("Partitioned tables created successfully")
+        except Exception as e:
+            print(f"Error creating tables: {e}")
+            raise
+    
+    def ensure_partition(self, received_date):
+        start = month_start(received_date)
+        name = partition_name(start)
+        if name in self._known_partitions:
+            return
+        
+        query = f"""
+        CREATE TABLE IF NOT EXISTS {name} PARTITION OF emails
+            FOR VALUES FROM (%s) TO (%s)
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(query, (start, next_month(start)))
+        cursor.close()
+        self._known_partitions.add(name)
+    
     def insert_email(self, email_data):
+        if self.partitioned:
+            return self.insert_partitioned_email(email_data)
+        
         insert_query = """
         INSERT INTO emails (message_id, thread_id, from_email, to_email, 
                           subject, message_body, received_date, is_read, labels)
@@ -62,21 +147,123 @@ class DatabaseManager:
             cursor.execute(insert_query, email_data)
             self.conn.commit()
             cursor.close()
+            return True
+        except Exception as e:
+            print(f"Error inserting email: {e}")
+            self.conn.rollback()
+            return False
+    
+    def insert_partitioned_email(self, email_data):
+        insert_query = """
+        INSERT INTO emails (message_id, thread_id, from_email, to_email,
+                          subject, received_date, is_read, labels)
+        VALUES (%(message_id)s, %(thread_id)s, %(from_email)s, %(to_email)s,
+                %(subject)s, %(received_date)s, %(is_read)s, %(labels)s)
+        ON CONFLICT (message_id, received_date) DO UPDATE SET
+            is_read = EXCLUDED.is_read,
+            labels = EXCLUDED.labels;
+        """
+        body_query = """
+        INSERT INTO email_bodies (message_id, body_compressed)
+        VALUES (%s, %s)
+        ON CONFLICT (message_id) DO NOTHING;
+        """
+        
+        row = dict(email_data)
+        received_date = row.get('received_date') or NO_DATE
+        if received_date.tzinfo is not None:
+            # Convert to local time like the single-table timestamptz cast,
+            # rather than keeping the sender's wall-clock time
+            received_date = received_date.astimezone().replace(tzinfo=None)
+        row['received_date'] = received_date
+        body = (row.pop('message_body', '') or '').encode('utf-8')
+        
+        try:
+            cursor = self.conn.cursor()
+            # message_id alone is not unique across partitions, and the local
+            # date depends on the inserting process's timezone. Serialise
+            # inserts per message and reuse the stored date so a message is
+            # never split into two rows.
+            cursor.execute("SELECT pg_advisory_xact_lock(hashtext(%s))",
+                           (row['message_id'],))
+            cursor.execute("SELECT received_date FROM emails WHERE message_id = %s LIMIT 1",
+                           (row['message_id'],))
+            existing = cursor.fetchone()
+            if existing is not None:
+                row['received_date'] = existing[0]
+            elif received_date != NO_DATE:
+                self.ensure_partition(received_date)
+            cursor.execute(insert_query, row)
+            cursor.execute(body_query, (row['message_id'],
+                                        psycopg2.Binary(zlib.compress(body))))
+            self.conn.commit()
+            cursor.close()
+            return True
         except Exception as e:
             print(f"Error inserting email: {e}")
             self.conn.rollback()
+            self._known_partitions.clear()
+            return False
     
-    def get_all_emails(self):
-        query = "SELECT * FROM emails ORDER BY received_date DESC"
+    def get_all_emails(self, since=None, until=None, include_body=True):
+        # since/until bound received_date so partitioned tables can prune
+        # months outside the window; include_body=False skips body storage.
+        conditions = []
+        params = []
+        if since is not None:
+            conditions.append("e.received_date >= %s")
+            params.append(since)
+        if until is not None:
+            conditions.append("e.received_date < %s")
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        
+        if not self.partitioned:
+            columns = "e.*" if include_body else (
+                "e.id, e.message_id, e.thread_id, e.from_email, e.to_email, "
+                "e.subject, e.received_date, e.is_read, e.labels, e.created_at")
+            query = f"SELECT {columns} FROM emails e {where} ORDER BY e.received_date DESC"
+        else:
+            columns = (
+                "e.id, e.message_id, e.thread_id, e.from_email, e.to_email, "
+                "e.subject, NULLIF(e.received_date, %s) AS received_date, "
+                "e.is_read, e.labels, e.created_at")
+            join = ""
+            if include_body:
+                columns += ", b.body_compressed"
+                join = "LEFT JOIN email_bodies b ON b.message_id = e.message_id"
+            query = f"SELECT {columns} FROM emails e {join} {where} ORDER BY e.received_date DESC"
+            params.insert(0, NO_DATE)
+        
         try:
             cursor = self.conn.cursor(cursor_factory=RealDictCursor)
-            cursor.execute(query)
+            cursor.execute(query, params)
             results = cursor.fetchall()
             cursor.close()
-            return results
         except Exception as e:
             print(f"Error fetching emails: {e}")
             return []
+        
+        if self.partitioned and include_body:
+            for row in results:
+                compressed = row.pop('body_compressed', None)
+                row['message_body'] = (
+                    zlib.decompress(bytes(compressed)).decode('utf-8', errors='ignore')
+                    if compressed is not None else '')
+        return results
+    
+    def get_message_ids(self):
+        query = "SELECT message_id FROM emails"
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(query)
+            message_ids = {row[0] for row in cursor.fetchall()}
+            cursor.close()
+            return message_ids
+        except Exception as e:
+            print(f"Error fetching message ids: {e}")
+            self.conn.rollback()
+            return set()
     
     def update_email_status(self, message_id, is_read):
         query = "UPDATE emails SET is_read = %s WHERE message_id = %s"
@@ -89,6 +276,75 @@ class DatabaseManager:
             print(f"Error updating email status: {e}")
             self.conn.rollback()
     
+    def list_partitions(self):
+        query = """
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relname = 'emails'
+        """
+        cursor = self.conn.cursor()
+        cursor.execute(query)
+        names = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        return names
+    
+    def archive_table_name(self, cursor, name):
+        # A late insert can re-create a month that was already archived, so
+        # pick archive_<name>_2, _3, ... instead of colliding with it
+        candidate = f"archive_{name}"
+        suffix = 2
+        while True:
+            cursor.execute("SELECT to_regclass(%s)", (candidate,))
+            if cursor.fetchone()[0] is None:
+                return candidate
+            candidate = f"archive_{name}_{suffix}"
+            suffix += 1
+    
+    def apply_retention(self, retention_months, archive=False, now=None):
+        # Drops (or detaches as archive_* tables) monthly partitions that end
+        # before the retention cutoff, along with their stored bodies.
+        if not self.partitioned:
+            print("Retention only applies to the partitioned schema")
+            return []
+        
+        cutoff = month_start(now or datetime.now())
+        for _ in range(retention_months):
+            cutoff = previous_month(cutoff)
+        
+        expired = []
+        try:
+            for name in sorted(self.list_partitions()):
+                if name == 'emails_default':
+                    continue
+                try:
+                    start = datetime.strptime(name, "emails_y%Ym%m")
+                except ValueError:
+                    continue
+                if next_month(start) > cutoff:
+                    continue
+                
+                cursor = self.conn.cursor()
+                cursor.execute(f"ALTER TABLE emails DETACH PARTITION {name}")
+                if archive:
+                    archive_name = self.archive_table_name(cursor, name)
+                    cursor.execute(f"ALTER TABLE {name} RENAME TO {archive_name}")
+                else:
+                    cursor.execute(
+                        f"DELETE FROM email_bodies b USING {name} e "
+                        f"WHERE b.message_id = e.message_id")
+                    cursor.execute(f"DROP TABLE {name}")
+                self.conn.commit()
+                cursor.close()
+                self._known_partitions.discard(name)
+                expired.append(name)
+        except Exception as e:
+            print(f"Error applying retention: {e}")
+            self.conn.rollback()
+            raise
+        
+        return expired
+    
     def close(self):
         if self.conn:
-            self.conn.close()
\ No newline at end of file
+            self.conn.close()
@@ -8,6 +8,8 @@ class EmailFetcher:
     def __init__(self, service, db_manager):
         self.service = service
         self.db = db_manager
+        # Ids returned by the most recent Gmail listing
+        self.last_listed_ids = set()
         
     def parse_email_headers(self, headers):
         header_dict = {}
@@ -37,17 +39,43 @@ class EmailFetcher:
         
         return body
     
-    def fetch_emails(self, max_results=100):
-        print(f"Fetching up to {max_results} emails...")
+    def list_messages(self, max_results, skip_ids=None, max_pages=1):
+        messages = []
+        page_token = None
+        
+        for page_number in range(1, max_pages + 1):
+            params = {'userId': 'me', 'maxResults': max_results}
+            if page_token:
+                params['pageToken'] = page_token
+            results = self.service.users().messages().list(**params).execute()
+            page = results.get('messages', [])
+            messages.extend(page)
+            
+            page_token = results.get('nextPageToken')
+            # Stop once the listing reaches mail the caller already has
+            if not page_token or (skip_ids and any(m['id'] in skip_ids for m in page)):
+                break
+            if page_number == max_pages:
+                print(f'Stopped listing after {max_pages} page(s); older new mail is not fetched')
+        
+        return messages
+    
+    def fetch_emails(self, max_results=100, skip_ids=None, max_pages=1):
+        print(f"Fetching up to {max_results} emails per page...")
+        stored = []
         
         try:
-            results = self.service.users().messages().list(
-                userId='me', maxResults=max_results).execute()
-            messages = results.get('messages', [])
+            messages = self.list_messages(max_results, skip_ids=skip_ids,
+                                          max_pages=max_pages)
+            self.last_listed_ids = {m['id'] for m in messages}
+            
+            # Skip messages the caller already has to avoid re-downloading them
+            if skip_ids:
+                messages = [m for m in messages if m['id'] not in skip_ids]
             
             if not messages:
                 print('No messages found.')
-                return
+                return stored
             
             print(f'Found {len(messages)} messages. Processing...')
             
@@ -88,7 +116,10 @@ class EmailFetcher:
                         'labels': labels
                     }
                     
-                    self.db.insert_email(email_data)
+                    # Only report emails that were persisted, so failed
+                    # inserts are retried on the next fetch
+                    if self.db.insert_email(email_data):
+                        stored.append(email_data)
                     
                     if idx % 10 == 0:
                         print(f'Processed {idx}/{len(messages)} emails...')
@@ -98,6 +129,7 @@ class EmailFetcher:
                     continue
             
             print(f'Successfully processed {len(messages)} emails')
+            return stored
             
         except Exception as e:
             print(f"Error fetching emails: {e}")
@@ -107,7 +139,7 @@ def main():
     authenticator = GmailAuthenticator()
     service = authenticator.get_service()
     
-    db = DatabaseManager(config.DB_CONFIG)
+    db = DatabaseManager(config.DB_CONFIG, partitioned=config.PARTITIONED_SCHEMA)
     db.connect()
     db.create_tables()
     
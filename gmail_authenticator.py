@@ -1,36 +1,76 @@
 import os
 import pickle
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+
+# The Google client stack is imported inside the methods that need it, so
+# scripts that never reach the Gmail API do not pay its import cost.
 
 SCOPES = ['https://www.googleapis.com/auth/gmail.modify']
 
+# Built services (with the credentials they use) and loaded credentials, reused for the life of the process
+_service_cache = {}
+_creds_cache = {}
+
 class GmailAuthenticator:
     def __init__(self, credentials_file='credentials.json', token_file='token.pickle'):
         self.credentials_file = credentials_file
         self.token_file = token_file
-        self.creds = None
+        self.creds = _creds_cache.get(token_file)
         
     def authenticate(self):
-        if os.path.exists(self.token_file):
+        if self.creds and self.creds.valid:
+            return self.creds
+        
+        if not self.creds and os.path.exists(self.token_file):
             with open(self.token_file, 'rb') as token:
                 self.creds = pickle.load(token)
         
         if not self.creds or not self.creds.valid:
             if self.creds and self.creds.expired and self.creds.refresh_token:
+                from google.auth.transport.requests import Request
                 self.creds.refresh(Request())
             else:
+                from google_auth_oauthlib.flow import InstalledAppFlow
                 flow = InstalledAppFlow.from_client_secrets_file(
                     self.credentials_file, SCOPES)
                 self.creds = flow.run_local_server(port=0)
-            
+        
             with open(self.token_file, 'wb') as token:
                 pickle.dump(self.creds, token)
         
+        _creds_cache[self.token_file] = self.creds
         return self.creds
     
     def get_service(self):
+        # Cached as (service, creds) so a service bound to replaced credentials is rebuilt
+        cached = _service_cache.get(self.token_file)
+        if cached is not None and cached[1] is self.creds and self.creds.valid:
+            return cached[0]
+        
         creds = self.authenticate()
-        return build('gmail', 'v1', credentials=creds)
\ No newline at end of file
+        if cached is not None and cached[1] is creds:
+            # refresh() updates the credentials in place, so the service still works
+            return cached[0]
+        
+        from googleapiclient.discovery import build
+        # Use the discovery document bundled with the client library instead
+        # of fetching it over the network on every run
+        service = build('gmail', 'v1', credentials=creds,
+                        static_discovery=True, cache_discovery=False)
+        _service_cache[self.token_file] = (service, creds)
+        return service
+    
+    def get_lazy_service(self):
+        return LazyGmailService(self)
+
+class LazyGmailService:
+    """Stands in for the Gmail service and only authenticates and builds
+    it on the first API call, so runs with no matching rules skip it."""
+    
+    def __init__(self, authenticator):
+        self._authenticator = authenticator
+        self._service = None
+    
+    def __getattr__(self, name):
+        if self._service is None:
+            self._service = self._authenticator.get_service()
+        return getattr(self._service, name)
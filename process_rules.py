@@ -1,7 +1,7 @@
 import json
 from gmail_authenticator import GmailAuthenticator
 from database_manager import DatabaseManager
-from rule_engine import RuleEngine
+from rule_engine import RuleEngine, get_date_bounds, rules_need_body
 import config
 
 def load_rules(rules_file='rules.json'):
@@ -16,13 +16,29 @@ def load_rules(rules_file='rules.json'):
         print(f"Error parsing rules file: {e}")
         return []
 
+def apply_rules(engine, emails, rules):
+    matched_count = 0
+    
+    # Process each email against each rule
+    for email in emails:
+        for rule_idx, rule in enumerate(rules, 1):
+            rule_name = rule.get('name', f'Rule {rule_idx}')
+            
+            if engine.check_rule(email, rule):
+                print(f"\nEmail '{email.get('subject', '')[:50]}...' matched {rule_name}")
+                actions = rule.get('actions', [])
+                engine.execute_actions(email, actions)
+                matched_count += 1
+    
+    return matched_count
+
 def process_emails_with_rules(rules_file='rules.json'):
-    # Setup Gmail service
+    # Setup Gmail service; it is only built once an action needs the API
     authenticator = GmailAuthenticator()
-    service = authenticator.get_service()
+    service = authenticator.get_lazy_service()
     
     # Setup database
-    db = DatabaseManager(config.DB_CONFIG)
+    db = DatabaseManager(config.DB_CONFIG, partitioned=config.PARTITIONED_SCHEMA)
     db.connect()
     
     # Load rules
@@ -34,25 +50,16 @@ def process_emails_with_rules(rules_file='rules.json'):
     
     print(f"Loaded {len(rules)} rule(s)")
     
-    # Get emails from database
-    emails = db.get_all_emails()
+    # Get emails from database, limited to the window the rules can match
+    since, until = get_date_bounds(rules)
+    emails = db.get_all_emails(since=since, until=until,
+                               include_body=rules_need_body(rules))
     print(f"Processing {len(emails)} emails against rules...")
     
     # Initialize rule engine
     engine = RuleEngine(db, service)
     
-    matched_count = 0
-    
-    # Process each email against each rule
-    for email in emails:
-        for rule_idx, rule in enumerate(rules, 1):
-            rule_name = rule.get('name', f'Rule {rule_idx}')
-            
-            if engine.check_rule(email, rule):
-                print(f"\nEmail '{email.get('subject', '')[:50]}...' matched {rule_name}")
-                actions = rule.get('actions', [])
-                engine.execute_actions(email, actions)
-                matched_count += 1
+    matched_count = apply_rules(engine, emails, rules)
     
     print(f"\n{'='*50}")
     print(f"Processing complete!")
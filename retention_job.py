@@ -0,0 +1,19 @@
+from database_manager import DatabaseManager
+import config
+
+def main():
+    db = DatabaseManager(config.DB_CONFIG, partitioned=config.PARTITIONED_SCHEMA)
+    db.connect()
+    
+    action = "Archived" if config.RETENTION_ARCHIVE else "Dropped"
+    expired = db.apply_retention(config.RETENTION_MONTHS,
+                                 archive=config.RETENTION_ARCHIVE)
+    
+    for name in expired:
+        print(f"{action} partition {name}")
+    print(f"Retention complete! {len(expired)} partition(s) expired")
+    
+    db.close()
+
+if __name__ == '__main__':
+    main()
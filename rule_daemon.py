@@ -0,0 +1,151 @@
+import json
+import os
+import signal
+import threading
+from gmail_authenticator import GmailAuthenticator
+from database_manager import DatabaseManager
+from fetch_emails import EmailFetcher
+from process_rules import apply_rules
+from rule_engine import RuleEngine, compile_rules, get_date_bounds, rules_need_body
+import config
+
+class RuleSet:
+    """Compiled, read-only snapshot of rules.json. The daemon swaps whole
+    snapshots, so a cycle never sees a half-updated rule list, and invalid
+    rules are rejected at load time instead of never matching."""
+    
+    def __init__(self, rules, mtime):
+        self.rules = compile_rules(rules)
+        self.mtime = mtime
+        self.since, self.until = get_date_bounds(self.rules)
+        self.needs_body = rules_need_body(self.rules)
+    
+    @classmethod
+    def load(cls, rules_file):
+        mtime = os.path.getmtime(rules_file)
+        with open(rules_file, 'r') as f:
+            rules_data = json.load(f)
+        
+        rules = rules_data.get('rules', [])
+        if not isinstance(rules, list):
+            raise ValueError("'rules' must be a list")
+        return cls(rules, mtime)
+
+class RuleDaemon:
+    def __init__(self, rules_file='rules.json', poll_interval=30, max_results=50,
+                 max_pages=10):
+        self.rules_file = rules_file
+        self.poll_interval = poll_interval
+        self.max_results = max_results
+        self.max_pages = max_pages
+        self.stop_event = threading.Event()
+        # Stored ids among the latest listing; seeded from the whole table
+        self.known_ids = None
+        self.rule_set = None
+        
+        self.service = GmailAuthenticator().get_service()
+        self.db = DatabaseManager(config.DB_CONFIG, partitioned=config.PARTITIONED_SCHEMA)
+        self.db.connect()
+        self.db.create_tables()
+        self.fetcher = EmailFetcher(self.service, self.db)
+        self.engine = RuleEngine(self.db, self.service)
+    
+    def reload_rules(self):
+        # Returns True when a new rule set was swapped in
+        try:
+            mtime = os.path.getmtime(self.rules_file)
+        except OSError as e:
+            print(f"Rules file {self.rules_file} unavailable: {e}")
+            return False
+        
+        if self.rule_set is not None and mtime == self.rule_set.mtime:
+            return False
+        
+        try:
+            rule_set = RuleSet.load(self.rules_file)
+        except (OSError, ValueError) as e:
+            # json.JSONDecodeError is a ValueError; keep serving the old rules
+            print(f"Error loading rules, keeping previous rule set: {e}")
+            return False
+        
+        self.rule_set = rule_set
+        print(f"Loaded {len(rule_set.rules)} rule(s) from {self.rules_file}")
+        return True
+    
+    def ensure_db(self):
+        if self.db.conn is None or self.db.conn.closed:
+            print("Reconnecting to database...")
+            self.db.connect()
+    
+    def process_stored_emails(self):
+        # Full pass over stored emails, run at startup and after a rules change
+        rule_set = self.rule_set
+        emails = self.db.get_all_emails(since=rule_set.since, until=rule_set.until,
+                                        include_body=rule_set.needs_body)
+        matched = apply_rules(self.engine, emails, rule_set.rules)
+        print(f"Full pass: {len(emails)} emails, {matched} rule match(es)")
+    
+    def process_new_emails(self):
+        rule_set = self.rule_set
+        new_emails = self.fetcher.fetch_emails(max_results=self.max_results,
+                                               skip_ids=self.known_ids,
+                                               max_pages=self.max_pages)
+        # Keep only ids Gmail still lists, so the set stays bounded
+        stored_ids = {email['message_id'] for email in new_emails}
+        self.known_ids = (self.known_ids | stored_ids) & self.fetcher.last_listed_ids
+        if new_emails:
+            matched = apply_rules(self.engine, new_emails, rule_set.rules)
+            print(f"New mail: {len(new_emails)} emails, {matched} rule match(es)")
+    
+    def run_cycle(self, full_pass=False):
+        self.ensure_db()
+        try:
+            if self.reload_rules():
+                full_pass = True
+            if self.rule_set is None:
+                print("No rules loaded, skipping cycle")
+                return
+            
+            if self.known_ids is None:
+                self.known_ids = self.db.get_message_ids()
+            if full_pass:
+                self.process_stored_emails()
+            self.process_new_emails()
+        finally:
+            self.end_transaction()
+    
+    def end_transaction(self):
+        # Reads open a transaction that holds ACCESS SHARE locks on emails;
+        # close it so retention and partition creation are not blocked
+        # while the daemon sleeps. Writes have already committed.
+        if self.db.conn is not None and not self.db.conn.closed:
+            self.db.conn.rollback()
+    
+    def run(self):
+        print(f"Rule daemon started, polling every {self.poll_interval}s")
+        full_pass = True
+        
+        while not self.stop_event.is_set():
+            try:
+                self.run_cycle(full_pass=full_pass)
+                full_pass = False
+            except Exception as e:
+                print(f"Error in daemon cycle: {e}")
+            self.stop_event.wait(self.poll_interval)
+        
+        self.db.close()
+        print("Rule daemon stopped")
+    
+    def stop(self, *args):
+        self.stop_event.set()
+
+def main():
+    daemon = RuleDaemon(poll_interval=config.DAEMON_POLL_INTERVAL,
+                        max_results=config.DAEMON_MAX_RESULTS,
+                        max_pages=config.DAEMON_MAX_PAGES)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run()
+
+if __name__ == '__main__':
+    main()
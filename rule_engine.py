@@ -1,10 +1,145 @@
 from datetime import datetime, timedelta
+from types import MappingProxyType
 import re
 
+# Date bounds are widened by this much so naive DB timestamps, sender
+# timezones and the gap between planning and evaluation never drop a match.
+DATE_BOUND_SLACK = timedelta(days=1)
+
+def date_condition_delta(value):
+    try:
+        amount = int(value.get('amount', 0))
+        unit = value.get('unit', 'days')
+    except Exception:
+        return None
+    
+    if unit == 'days':
+        return timedelta(days=amount)
+    elif unit == 'months':
+        return timedelta(days=amount * 30)
+    return None
+
+STRING_FIELDS = ('from', 'subject', 'message')
+STRING_PREDICATES = ('contains', 'does_not_contain', 'equals', 'does_not_equal')
+DATE_PREDICATES = ('less_than', 'greater_than')
+ACTION_TYPES = ('mark_as_read', 'mark_as_unread', 'move')
+
+def compile_rule(rule, index=1):
+    """Validate a rule and return a read-only copy with lower-cased string
+    values and precomputed date deltas. Raises ValueError if it is invalid."""
+    if not isinstance(rule, dict):
+        raise ValueError(f"Rule {index} must be an object")
+    name = rule.get('name', f'Rule {index}')
+    
+    predicate_type = str(rule.get('predicate', 'all')).lower()
+    if predicate_type not in ('all', 'any'):
+        raise ValueError(f"{name}: unknown predicate '{predicate_type}'")
+    
+    conditions = rule.get('conditions')
+    if not conditions or not isinstance(conditions, list):
+        raise ValueError(f"{name}: 'conditions' must be a non-empty list")
+    
+    compiled_conditions = []
+    for cond in conditions:
+        field = cond.get('field')
+        predicate = cond.get('predicate')
+        value = cond.get('value')
+        
+        if field in STRING_FIELDS:
+            if predicate not in STRING_PREDICATES:
+                raise ValueError(f"{name}: '{predicate}' is not valid for '{field}'")
+            compiled = {'field': field, 'predicate': predicate,
+                        'value': value, 'value_lower': str(value).lower()}
+        elif field == 'received':
+            if predicate not in DATE_PREDICATES:
+                raise ValueError(f"{name}: '{predicate}' is not valid for 'received'")
+            delta = date_condition_delta(value) if isinstance(value, dict) else None
+            if delta is None:
+                raise ValueError(f"{name}: invalid date value {value!r}")
+            compiled = {'field': field, 'predicate': predicate,
+                        'value': MappingProxyType(dict(value)), 'delta': delta}
+        else:
+            raise ValueError(f"{name}: unknown field '{field}'")
+        
+        compiled_conditions.append(MappingProxyType(compiled))
+    
+    actions = rule.get('actions', [])
+    if not isinstance(actions, list):
+        raise ValueError(f"{name}: 'actions' must be a list")
+    for action in actions:
+        action_type = action.get('type')
+        if action_type not in ACTION_TYPES:
+            raise ValueError(f"{name}: unknown action '{action_type}'")
+        if action_type == 'move' and not action.get('destination'):
+            raise ValueError(f"{name}: move action needs a destination")
+    
+    return MappingProxyType({
+        'name': name,
+        'predicate': predicate_type,
+        'conditions': tuple(compiled_conditions),
+        'actions': tuple(MappingProxyType(dict(action)) for action in actions),
+    })
+
+def compile_rules(rules):
+    return tuple(compile_rule(rule, idx) for idx, rule in enumerate(rules, 1))
+
+def get_date_bounds(rules, now=None):
+    """Return a (since, until) received_date window covering every email
+    the rules could match, with None meaning unbounded on that side."""
+    now = now or datetime.now()
+    lower_bounds = []
+    upper_bounds = []
+    
+    for rule in rules:
+        conditions = rule.get('conditions', [])
+        predicate_type = rule.get('predicate', 'all').lower()
+        
+        # Rules that can never match do not widen the window
+        if not conditions or predicate_type not in ('all', 'any'):
+            continue
+        
+        lower = None
+        upper = None
+        if predicate_type == 'all':
+            for cond in conditions:
+                if cond.get('field') != 'received':
+                    continue
+                delta = cond.get('delta')
+                if delta is None:
+                    delta = date_condition_delta(cond.get('value') or {})
+                if delta is None:
+                    continue
+                threshold = now - delta
+                if cond.get('predicate') == 'less_than':
+                    lower = threshold if lower is None else max(lower, threshold)
+                elif cond.get('predicate') == 'greater_than':
+                    upper = threshold if upper is None else min(upper, threshold)
+        
+        lower_bounds.append(lower)
+        upper_bounds.append(upper)
+    
+    if not lower_bounds:
+        return None, None
+    
+    since = None
+    if None not in lower_bounds:
+        since = min(lower_bounds) - DATE_BOUND_SLACK
+    until = None
+    if None not in upper_bounds:
+        until = max(upper_bounds) + DATE_BOUND_SLACK
+    return since, until
+
+def rules_need_body(rules):
+    return any(cond.get('field') == 'message'
+               for rule in rules
+               for cond in rule.get('conditions', []))
+
 class RuleEngine:
     def __init__(self, db_manager, gmail_service):
         self.db = db_manager
         self.service = gmail_service
+        # Lower-cased label name -> id, filled on first move and kept warm
+        self.label_cache = None
     
     def evaluate_condition(self, email, condition):
         field = condition.get('field')
@@ -18,11 +153,15 @@ class RuleEngine:
         elif field == 'message':
             email_value = email.get('message_body', '').lower()
         elif field == 'received':
-            return self.evaluate_date_condition(email, predicate, value)
+            return self.evaluate_date_condition(email, predicate, value,
+                                                delta=condition.get('delta'))
         else:
             return False
         
-        value_lower = str(value).lower()
+        # Compiled conditions carry the lower-cased value already
+        value_lower = condition.get('value_lower')
+        if value_lower is None:
+            value_lower = str(value).lower()
         
         if predicate == 'contains':
             return value_lower in email_value
@@ -35,7 +174,7 @@ class RuleEngine:
         
         return False
     
-    def evaluate_date_condition(self, email, predicate, value):
+    def evaluate_date_condition(self, email, predicate, value, delta=None):
         received_date = email.get('received_date')
         if not received_date:
             return False
@@ -49,14 +188,9 @@ class RuleEngine:
                 received_date = received_date.replace(tzinfo=None)
         
         try:
-            amount = int(value.get('amount', 0))
-            unit = value.get('unit', 'days')
-            
-            if unit == 'days':
-                delta = timedelta(days=amount)
-            elif unit == 'months':
-                delta = timedelta(days=amount * 30)
-            else:
+            if delta is None:
+                delta = date_condition_delta(value)
+            if delta is None:
                 return False
             
             threshold_date = now - delta
@@ -132,24 +266,32 @@ class RuleEngine:
         label_id = self.get_or_create_label(destination_label)
         
         if label_id:
-            self.service.users().messages().modify(
-                userId='me',
-                id=message_id,
-                body={
-                    'addLabelIds': [label_id],
-                    'removeLabelIds': ['INBOX']
-                }
-            ).execute()
+            try:
+                self.service.users().messages().modify(
+                    userId='me',
+                    id=message_id,
+                    body={
+                        'addLabelIds': [label_id],
+                        'removeLabelIds': ['INBOX']
+                    }
+                ).execute()
+            except Exception:
+                # The label may have been deleted or renamed in Gmail;
+                # list labels again on the next move
+                self.label_cache = None
+                raise
     
     def get_or_create_label(self, label_name):
         try:
-            # List existing labels
-            results = self.service.users().labels().list(userId='me').execute()
-            labels = results.get('labels', [])
+            # List existing labels once and reuse the map afterwards
+            if self.label_cache is None:
+                results = self.service.users().labels().list(userId='me').execute()
+                self.label_cache = {}
+                for label in results.get('labels', []):
+                    self.label_cache.setdefault(label['name'].lower(), label['id'])
             
-            for label in labels:
-                if label['name'].lower() == label_name.lower():
-                    return label['id']
+            if label_name.lower() in self.label_cache:
+                return self.label_cache[label_name.lower()]
             
             # Create new label if not found
             label_object = {
@@ -163,8 +305,12 @@ class RuleEngine:
                 body=label_object
             ).execute()
             
+            self.label_cache[label_name.lower()] = created_label['id']
             return created_label['id']
             
         except Exception as e:
             print(f"Error with label {label_name}: {e}")
+            # The label may have been created in Gmail since the map was
+            # listed; list labels again on the next move
+            self.label_cache = None
             return None
\ No newline at end of file
@@ -1,7 +1,10 @@
+import json
+import os
+import tempfile
 import unittest
 from unittest.mock import Mock, MagicMock, patch
-from datetime import datetime, timedelta
-from rule_engine import RuleEngine
+from datetime import datetime, timedelta, timezone
+from rule_engine import RuleEngine, compile_rule, get_date_bounds, rules_need_body
 
 class TestRuleEngine(unittest.TestCase):
     
@@ -155,6 +158,40 @@ class TestRuleEngine(unittest.TestCase):
         mock_modify.assert_called_once()
         self.mock_db.update_email_status.assert_called_with('test123', True)
     
+    def test_label_map_listed_once(self):
+        self.mock_service.users().labels().list().execute.return_value = {
+            'labels': [{'name': 'Marketing', 'id': 'Label_1'}]
+        }
+        self.mock_service.users().labels().list.reset_mock()
+        
+        self.assertEqual(self.engine.get_or_create_label('marketing'), 'Label_1')
+        self.assertEqual(self.engine.get_or_create_label('Marketing'), 'Label_1')
+        self.mock_service.users().labels().list.assert_called_once()
+    
+    def test_label_map_cleared_when_move_fails(self):
+        self.mock_service.users().labels().list().execute.return_value = {
+            'labels': [{'name': 'Marketing', 'id': 'Label_1'}]
+        }
+        self.mock_service.users().messages().modify().execute.side_effect = Exception('404')
+        
+        with self.assertRaises(Exception):
+            self.engine.move_message('test123', 'Marketing')
+        self.assertIsNone(self.engine.label_cache)
+    
+    def test_label_map_cleared_when_create_fails(self):
+        self.mock_service.users().labels().list().execute.return_value = {'labels': []}
+        self.engine.get_or_create_label('Other')
+        
+        # Marketing was created in Gmail after the map was cached
+        self.mock_service.users().labels().create().execute.side_effect = Exception('409')
+        self.assertIsNone(self.engine.get_or_create_label('Marketing'))
+        self.assertIsNone(self.engine.label_cache)
+        
+        self.mock_service.users().labels().list().execute.return_value = {
+            'labels': [{'name': 'Marketing', 'id': 'Label_1'}]
+        }
+        self.assertEqual(self.engine.get_or_create_label('Marketing'), 'Label_1')
+    
     def test_case_insensitive_matching(self):
         condition = {
             'field': 'subject',
@@ -164,6 +201,176 @@ class TestRuleEngine(unittest.TestCase):
         result = self.engine.evaluate_condition(self.sample_email, condition)
         self.assertTrue(result)
 
+class TestDateBounds(unittest.TestCase):
+    
+    def setUp(self):
+        self.now = datetime(2025, 6, 15)
+    
+    def test_bounds_from_all_predicate(self):
+        rules = [{
+            'predicate': 'all',
+            'conditions': [
+                {'field': 'subject', 'predicate': 'contains', 'value': 'Test'},
+                {'field': 'received', 'predicate': 'less_than',
+                 'value': {'amount': 7, 'unit': 'days'}}
+            ]
+        }]
+        since, until = get_date_bounds(rules, now=self.now)
+        self.assertEqual(since, datetime(2025, 6, 7))
+        self.assertIsNone(until)
+    
+    def test_bounds_unbounded_rule_widens_window(self):
+        rules = [
+            {'predicate': 'all', 'conditions': [
+                {'field': 'received', 'predicate': 'greater_than',
+                 'value': {'amount': 1, 'unit': 'months'}}]},
+            {'predicate': 'any', 'conditions': [
+                {'field': 'received', 'predicate': 'greater_than',
+                 'value': {'amount': 2, 'unit': 'months'}},
+                {'field': 'from', 'predicate': 'contains', 'value': 'boss'}]}
+        ]
+        self.assertEqual(get_date_bounds(rules, now=self.now), (None, None))
+    
+    def test_rules_need_body(self):
+        rules = [{'predicate': 'all', 'conditions': [
+            {'field': 'message', 'predicate': 'contains', 'value': 'invoice'}]}]
+        self.assertTrue(rules_need_body(rules))
+        rules[0]['conditions'][0]['field'] = 'subject'
+        self.assertFalse(rules_need_body(rules))
+
+class TestCompileRule(unittest.TestCase):
+    
+    def setUp(self):
+        self.engine = RuleEngine(Mock(), Mock())
+    
+    def test_compile_normalises_conditions(self):
+        rule = compile_rule({
+            'name': 'Mixed',
+            'predicate': 'ALL',
+            'conditions': [
+                {'field': 'subject', 'predicate': 'contains', 'value': 'TEST'},
+                {'field': 'received', 'predicate': 'less_than',
+                 'value': {'amount': 2, 'unit': 'months'}}
+            ],
+            'actions': [{'type': 'move', 'destination': 'Archive'}]
+        })
+        
+        self.assertEqual(rule['predicate'], 'all')
+        self.assertEqual(rule['conditions'][0]['value_lower'], 'test')
+        self.assertEqual(rule['conditions'][1]['delta'], timedelta(days=60))
+        with self.assertRaises(TypeError):
+            rule['conditions'][0]['value_lower'] = 'other'
+        
+        email = {'subject': 'A test', 'received_date': datetime.now()}
+        self.assertTrue(self.engine.check_rule(email, rule))
+    
+    def test_compile_rejects_invalid_rules(self):
+        invalid = [
+            {'predicate': 'some', 'conditions': [
+                {'field': 'from', 'predicate': 'contains', 'value': 'a'}]},
+            {'conditions': []},
+            {'conditions': [{'field': 'to', 'predicate': 'contains', 'value': 'a'}]},
+            {'conditions': [{'field': 'from', 'predicate': 'less_than', 'value': 'a'}]},
+            {'conditions': [{'field': 'received', 'predicate': 'less_than',
+                             'value': {'amount': 1, 'unit': 'weeks'}}]},
+            {'conditions': [{'field': 'from', 'predicate': 'contains', 'value': 'a'}],
+             'actions': [{'type': 'move'}]},
+        ]
+        for rule in invalid:
+            with self.assertRaises(ValueError):
+                compile_rule(rule)
+
+class TestLazyGmailService(unittest.TestCase):
+    
+    def test_service_built_on_first_use(self):
+        from gmail_authenticator import LazyGmailService
+        
+        mock_auth = Mock()
+        service = LazyGmailService(mock_auth)
+        mock_auth.get_service.assert_not_called()
+        
+        service.users()
+        service.users()
+        mock_auth.get_service.assert_called_once()
+
+class TestGmailAuthenticator(unittest.TestCase):
+    
+    def setUp(self):
+        import gmail_authenticator
+        
+        gmail_authenticator._service_cache.clear()
+        gmail_authenticator._creds_cache.clear()
+        self.addCleanup(gmail_authenticator._service_cache.clear)
+        self.addCleanup(gmail_authenticator._creds_cache.clear)
+    
+    @patch('googleapiclient.discovery.build')
+    @patch('gmail_authenticator.pickle.load')
+    @patch('gmail_authenticator.open', create=True)
+    @patch('gmail_authenticator.os.path.exists', return_value=True)
+    def test_service_and_credentials_cached_per_process(self, mock_exists, mock_open,
+                                                        mock_load, mock_build):
+        from gmail_authenticator import GmailAuthenticator
+        
+        mock_load.return_value = Mock(valid=True)
+        
+        first = GmailAuthenticator().get_service()
+        second = GmailAuthenticator().get_service()
+        
+        self.assertIs(first, second)
+        mock_load.assert_called_once()
+        mock_build.assert_called_once()
+        self.assertTrue(mock_build.call_args[1]['static_discovery'])
+    
+    @patch('googleapiclient.discovery.build')
+    def test_service_rebuilt_for_new_credentials(self, mock_build):
+        from gmail_authenticator import GmailAuthenticator
+        
+        old_creds = Mock(valid=True)
+        new_creds = Mock(valid=True)
+        mock_build.side_effect = [Mock(), Mock()]
+        
+        auth = GmailAuthenticator()
+        auth.creds = old_creds
+        first = auth.get_service()
+        
+        # Expired without a refresh token: the OAuth flow yields new credentials
+        old_creds.valid = False
+        with patch.object(GmailAuthenticator, 'authenticate', return_value=new_creds):
+            second = auth.get_service()
+        
+        self.assertIsNot(first, second)
+        self.assertEqual(mock_build.call_count, 2)
+        self.assertIs(mock_build.call_args[1]['credentials'], new_creds)
+
+class TestEmailFetcher(unittest.TestCase):
+    
+    def setUp(self):
+        from fetch_emails import EmailFetcher
+        
+        self.mock_service = Mock()
+        self.mock_list = self.mock_service.users().messages().list
+        self.fetcher = EmailFetcher(self.mock_service, Mock())
+    
+    def test_list_messages_pages_until_known_id(self):
+        self.mock_list.return_value.execute.side_effect = [
+            {'messages': [{'id': 'new1'}, {'id': 'new2'}], 'nextPageToken': 'p2'},
+            {'messages': [{'id': 'new3'}, {'id': 'old1'}], 'nextPageToken': 'p3'},
+            {'messages': [{'id': 'old2'}]},
+        ]
+        
+        messages = self.fetcher.list_messages(2, skip_ids={'old1'}, max_pages=10)
+        
+        self.assertEqual([m['id'] for m in messages], ['new1', 'new2', 'new3', 'old1'])
+        self.assertEqual(self.mock_list.call_args[1]['pageToken'], 'p2')
+    
+    def test_list_messages_stops_at_page_cap(self):
+        self.mock_list.return_value.execute.return_value = {
+            'messages': [{'id': 'new'}], 'nextPageToken': 'more'}
+        
+        messages = self.fetcher.list_messages(1, skip_ids={'old1'}, max_pages=3)
+        
+        self.assertEqual(len(messages), 3)
+
 class TestDatabaseIntegration(unittest.TestCase):
     
     @patch('database_manager.psycopg2.connect')
@@ -210,10 +417,343 @@ class TestDatabaseIntegration(unittest.TestCase):
             'labels': ['INBOX']
         }
         
-        db.insert_email(email_data)
+        self.assertTrue(db.insert_email(email_data))
         
         mock_cursor.execute.assert_called_once()
         mock_conn.commit.assert_called_once()
+    
+    @patch('database_manager.psycopg2.connect')
+    def test_insert_email_failure_returns_false(self, mock_connect):
+        from database_manager import DatabaseManager
+        
+        mock_conn = Mock()
+        mock_conn.cursor.return_value.execute.side_effect = Exception('boom')
+        
+        db = DatabaseManager({})
+        db.conn = mock_conn
+        
+        self.assertFalse(db.insert_email({'message_id': 'test123'}))
+        mock_conn.rollback.assert_called_once()
+    
+    @patch('database_manager.psycopg2.connect')
+    def test_insert_email_partitioned(self, mock_connect):
+        from database_manager import DatabaseManager
+        
+        mock_conn = Mock()
+        mock_cursor = Mock()
+        mock_cursor.fetchone.return_value = None
+        mock_conn.cursor.return_value = mock_cursor
+        
+        db = DatabaseManager({}, partitioned=True)
+        db.conn = mock_conn
+        
+        email_data = {
+            'message_id': 'test123',
+            'thread_id': 'thread123',
+            'from_email': 'test@example.com',
+            'to_email': 'recipient@example.com',
+            'subject': 'Test',
+            'message_body': 'Body',
+            'received_date': datetime(2025, 3, 14),
+            'is_read': False,
+            'labels': ['INBOX']
+        }
+        
+        db.insert_email(email_data)
+        
+        queries = [c[0][0] for c in mock_cursor.execute.call_args_list]
+        self.assertIn('pg_advisory_xact_lock', queries[0])
+        self.assertIn('SELECT received_date', queries[1])
+        self.assertIn('emails_y2025m03', queries[2])
+        self.assertIn('INSERT INTO emails', queries[3])
+        self.assertIn('INSERT INTO email_bodies', queries[4])
+        mock_conn.commit.assert_called_once()
+    
+    @patch('database_manager.psycopg2.connect')
+    def test_insert_email_partitioned_converts_offset(self, mock_connect):
+        from database_manager import DatabaseManager, partition_name
+        
+        mock_conn = Mock()
+        mock_cursor = Mock()
+        mock_cursor.fetchone.return_value = None
+        mock_conn.cursor.return_value = mock_cursor
+        
+        db = DatabaseManager({}, partitioned=True)
+        db.conn = mock_conn
+        
+        # Late on the last day of the month in a far-off timezone
+        received_date = datetime(2025, 3, 31, 23, 30,
+                                 tzinfo=timezone(timedelta(hours=-12)))
+        expected = received_date.astimezone().replace(tzinfo=None)
+        
+        db.insert_email({
+            'message_id': 'test123',
+            'thread_id': 'thread123',
+            'from_email': 'test@example.com',
+            'to_email': 'recipient@example.com',
+            'subject': 'Test',
+            'message_body': 'Body',
+            'received_date': received_date,
+            'is_read': False,
+            'labels': ['INBOX']
+        })
+        
+        calls = mock_cursor.execute.call_args_list
+        self.assertIn(partition_name(expected), calls[2][0][0])
+        self.assertEqual(calls[3][0][1]['received_date'], expected)
+
+class TestPartitionedNoDate(unittest.TestCase):
+    
+    def setUp(self):
+        from database_manager import DatabaseManager
+        
+        self.mock_cursor = Mock()
+        self.mock_cursor.fetchone.return_value = None
+        mock_conn = Mock()
+        mock_conn.cursor.return_value = self.mock_cursor
+        
+        self.db = DatabaseManager({}, partitioned=True)
+        self.db.conn = mock_conn
+        self.email_data = {
+            'message_id': 'test123',
+            'thread_id': 'thread123',
+            'from_email': 'test@example.com',
+            'to_email': 'recipient@example.com',
+            'subject': 'Test',
+            'message_body': 'Body',
+            'is_read': False,
+            'labels': ['INBOX']
+        }
+    
+    def executed(self):
+        return [c[0][0] for c in self.mock_cursor.execute.call_args_list]
+    
+    def test_missing_date_uses_sentinel_without_partition(self):
+        from database_manager import NO_DATE
+        
+        self.db.insert_email(dict(self.email_data, received_date=None))
+        
+        self.assertFalse(any('PARTITION OF' in q for q in self.executed()))
+        insert = [c for c in self.mock_cursor.execute.call_args_list
+                  if 'INSERT INTO emails' in c[0][0]][0]
+        self.assertEqual(insert[0][1]['received_date'], NO_DATE)
+    
+    def test_reinsert_reuses_stored_date(self):
+        # First stored by a process in another timezone
+        stored_date = datetime(2025, 3, 31, 23, 30)
+        self.mock_cursor.fetchone.return_value = (stored_date,)
+        received_date = datetime(2025, 4, 1, 6, 30, tzinfo=timezone(timedelta(hours=9)))
+        
+        self.assertTrue(self.db.insert_email(
+            dict(self.email_data, received_date=received_date, is_read=True)))
+        
+        queries = self.executed()
+        self.assertFalse(any('PARTITION OF' in q for q in queries))
+        insert = [c for c in self.mock_cursor.execute.call_args_list
+                  if 'INSERT INTO emails' in c[0][0]][0]
+        self.assertIn('ON CONFLICT (message_id, received_date) DO UPDATE', insert[0][0])
+        self.assertEqual(insert[0][1]['received_date'], stored_date)
+        self.assertTrue(insert[0][1]['is_read'])
+    
+    def test_unix_epoch_date_gets_real_partition(self):
+        received_date = datetime(1970, 1, 1, 12, 0, tzinfo=timezone.utc)
+        expected = received_date.astimezone().replace(tzinfo=None)
+        
+        self.db.insert_email(dict(self.email_data, received_date=received_date))
+        
+        self.assertTrue(any(f"emails_y{expected.year:04d}m{expected.month:02d}" in q
+                            for q in self.executed()))
+
+class TestRetention(unittest.TestCase):
+    
+    def setUp(self):
+        from database_manager import DatabaseManager
+        
+        self.mock_conn = Mock()
+        self.mock_cursor = Mock()
+        self.mock_conn.cursor.return_value = self.mock_cursor
+        
+        self.db = DatabaseManager({}, partitioned=True)
+        self.db.conn = self.mock_conn
+        self.now = datetime(2025, 6, 15)
+    
+    def executed(self):
+        return [c[0][0] for c in self.mock_cursor.execute.call_args_list]
+    
+    def test_cutoff_keeps_exactly_retention_months(self):
+        self.db.list_partitions = Mock(return_value=[
+            'emails_y2024m05', 'emails_y2024m06', 'emails_y2025m06'])
+        
+        expired = self.db.apply_retention(12, now=self.now)
+        
+        self.assertEqual(expired, ['emails_y2024m05'])
+        self.assertIn('DROP TABLE emails_y2024m05', self.executed())
+        self.assertFalse(any('emails_y2024m06' in q for q in self.executed()))
+    
+    def test_default_partition_skipped(self):
+        self.db.list_partitions = Mock(return_value=['emails_default'])
+        
+        self.assertEqual(self.db.apply_retention(1, now=self.now), [])
+        self.mock_cursor.execute.assert_not_called()
+    
+    def test_drop_deletes_bodies(self):
+        self.db.list_partitions = Mock(return_value=['emails_y2020m01'])
+        
+        self.db.apply_retention(12, now=self.now)
+        
+        queries = self.executed()
+        self.assertIn('DETACH PARTITION emails_y2020m01', queries[0])
+        self.assertIn('DELETE FROM email_bodies', queries[1])
+        self.assertIn('DROP TABLE emails_y2020m01', queries[2])
+    
+    def test_archive_avoids_name_collision(self):
+        self.db.list_partitions = Mock(return_value=['emails_y2020m01'])
+        # archive_emails_y2020m01 already exists, the _2 name is free
+        self.mock_cursor.fetchone.side_effect = [('archive_emails_y2020m01',), (None,)]
+        
+        self.db.apply_retention(12, archive=True, now=self.now)
+        
+        self.assertIn('ALTER TABLE emails_y2020m01 RENAME TO archive_emails_y2020m01_2',
+                      self.executed())
+        self.assertFalse(any('DROP TABLE' in q for q in self.executed()))
+
+class TestRuleDaemon(unittest.TestCase):
+    
+    def make_daemon(self, rules_file=None):
+        from rule_daemon import RuleDaemon
+        
+        daemon = RuleDaemon.__new__(RuleDaemon)
+        daemon.rules_file = rules_file
+        daemon.max_results = 50
+        daemon.max_pages = 10
+        daemon.known_ids = set()
+        daemon.rule_set = None
+        daemon.db = Mock()
+        daemon.db.conn.closed = 0
+        daemon.fetcher = Mock()
+        daemon.engine = Mock()
+        return daemon
+    
+    def write_rules(self, rules):
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump({'rules': rules}, f)
+        self.addCleanup(os.unlink, f.name)
+        return f.name
+    
+    def test_rule_set_load(self):
+        from rule_daemon import RuleSet
+        
+        rules = [{'name': 'Recent', 'predicate': 'all', 'conditions': [
+            {'field': 'message', 'predicate': 'contains', 'value': 'invoice'}]}]
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            json.dump({'rules': rules}, f)
+        self.addCleanup(os.unlink, f.name)
+        
+        rule_set = RuleSet.load(f.name)
+        self.assertEqual(len(rule_set.rules), 1)
+        self.assertEqual(rule_set.rules[0]['name'], 'Recent')
+        self.assertTrue(rule_set.needs_body)
+    
+    def test_reload_keeps_previous_rules_on_error(self):
+        from rule_daemon import RuleDaemon, RuleSet
+        
+        with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+            f.write('{not json')
+        self.addCleanup(os.unlink, f.name)
+        
+        daemon = RuleDaemon.__new__(RuleDaemon)
+        daemon.rules_file = f.name
+        previous = RuleSet([], mtime=0)
+        daemon.rule_set = previous
+        
+        self.assertFalse(daemon.reload_rules())
+        self.assertIs(daemon.rule_set, previous)
+    
+    def test_reload_rejects_invalid_rule(self):
+        from rule_daemon import RuleSet
+        
+        rules = [{'name': 'Typo', 'conditions': [
+            {'field': 'subjet', 'predicate': 'contains', 'value': 'x'}]}]
+        daemon = self.make_daemon(self.write_rules(rules))
+        previous = RuleSet([], mtime=0)
+        daemon.rule_set = previous
+        
+        self.assertFalse(daemon.reload_rules())
+        self.assertIs(daemon.rule_set, previous)
+    
+    def test_mtime_change_swaps_rules_and_forces_full_pass(self):
+        from rule_daemon import RuleSet
+        
+        rules = [{'name': 'New', 'predicate': 'all', 'conditions': [
+            {'field': 'subject', 'predicate': 'contains', 'value': 'invoice'}]}]
+        daemon = self.make_daemon(self.write_rules(rules))
+        previous = RuleSet([], mtime=0)
+        daemon.rule_set = previous
+        daemon.process_stored_emails = Mock()
+        daemon.process_new_emails = Mock()
+        
+        daemon.run_cycle(full_pass=False)
+        
+        self.assertIsNot(daemon.rule_set, previous)
+        self.assertEqual(daemon.rule_set.rules[0]['name'], 'New')
+        daemon.process_stored_emails.assert_called_once()
+        daemon.process_new_emails.assert_called_once()
+        
+        # Unchanged file: no reload and no full pass
+        daemon.run_cycle(full_pass=False)
+        daemon.process_stored_emails.assert_called_once()
+        self.assertEqual(daemon.process_new_emails.call_count, 2)
+    
+    @patch('rule_daemon.apply_rules', return_value=1)
+    def test_process_new_emails_skips_known_ids(self, mock_apply):
+        from rule_daemon import RuleSet
+        
+        daemon = self.make_daemon()
+        daemon.rule_set = RuleSet([], mtime=0)
+        known_ids = {'old1', 'gone1'}
+        daemon.known_ids = known_ids
+        new_email = {'message_id': 'new1', 'subject': 'Hi'}
+        daemon.fetcher.fetch_emails.return_value = [new_email]
+        daemon.fetcher.last_listed_ids = {'old1', 'new1'}
+        
+        daemon.process_new_emails()
+        
+        daemon.fetcher.fetch_emails.assert_called_once_with(
+            max_results=50, skip_ids=known_ids, max_pages=10)
+        mock_apply.assert_called_once_with(daemon.engine, [new_email], ())
+        # Ids no longer listed by Gmail are dropped
+        self.assertEqual(daemon.known_ids, {'old1', 'new1'})
+    
+    def test_known_ids_seeded_from_all_stored_ids(self):
+        daemon = self.make_daemon(self.write_rules([]))
+        daemon.known_ids = None
+        daemon.db.get_message_ids.return_value = {'old1'}
+        daemon.process_stored_emails = Mock()
+        daemon.process_new_emails = Mock()
+        
+        daemon.run_cycle()
+        
+        self.assertEqual(daemon.known_ids, {'old1'})
+    
+    def test_cycle_leaves_no_open_transaction(self):
+        daemon = self.make_daemon(self.write_rules([]))
+        daemon.process_stored_emails = Mock()
+        daemon.process_new_emails = Mock(side_effect=Exception('poll failed'))
+        
+        with self.assertRaises(Exception):
+            daemon.run_cycle()
+        
+        daemon.db.conn.rollback.assert_called_once()
+    
+    def test_ensure_db_reconnects_closed_connection(self):
+        daemon = self.make_daemon()
+        
+        daemon.ensure_db()
+        daemon.db.connect.assert_not_called()
+        
+        daemon.db.conn.closed = 1
+        daemon.ensure_db()
+        daemon.db.connect.assert_called_once()
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file